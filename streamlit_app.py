@@ -1,88 +1,96 @@
 # streamlit_app.py
 # Unibet Ctrl+A → Boss-shaped CSV/XLSX (Parse, Export) — Streamlit edition
 
+import functools
+import hashlib
 import io
 import re
 from typing import List, Tuple, Dict, Optional
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 # ---------- Unibet parsing (robust dashes, no duplicates) ----------
-RE_PLAYER_OF_MATCH = re.compile(r'^\s*Player\s+of\s+the\s+Match\s*$', re.IGNORECASE)
-RE_TOP_BOWLER_TEAM = re.compile(r'^\s*Top\s+Bowler\s*[–—-]\s*(.*?)\s*[–—-]\s*1st\s*Innings\s*$', re.IGNORECASE)
-RE_TOP_RUNSCORER_TEAM = re.compile(r'^\s*Top\s+Run\s*Scorer\s*[–—-]\s*(.*?)\s*[–—-]\s*1st\s*Innings\s*$', re.IGNORECASE)
+# one combined heading pattern: exactly one of the named groups captures the team for team markets
+RE_HEADING = re.compile(
+    r'^\s*(?:Player\s+of\s+the\s+Match'
+    r'|Top\s+Bowler\s*[–—-]\s*(?P<bowler>.*?)\s*[–—-]\s*1st\s*Innings'
+    r'|Top\s+Run\s*Scorer\s*[–—-]\s*(?P<batter>.*?)\s*[–—-]\s*1st\s*Innings)\s*$',
+    re.IGNORECASE
+)
+
 RE_DECIMAL = re.compile(r'^\d+(?:\.\d+)?$')
 
+# every heading starts with "Player ..." or "Top ..."; checked before running RE_HEADING
+_HEADING_PREFIXES = frozenset({"pla", "top"})
+
+RE_SPACES = re.compile(r"\s+")
+
 # anything that should end a prices list (also stop on generic "Top Run Scorer"/"Top Bowler")
-STOP_WORDS = {
+STOP_WORDS = frozenset({
     "view less","view more","odds format","help","safer gambling","about us","apps","blog",
     "fair gaming policy","unibet community","all sports","home","in-play","explore","favourites",
     "search sports, leagues or teams","toss winner","winner (incl. super over)","match","over","dismissal",
     "sports","casino","live casino","bingo","poker","top run scorer","top bowler"
-}
+})
 
 def _lines(text: str) -> List[str]:
-    return [ln.strip() for ln in text.replace("\r\n","\n").replace("\r","\n").split("\n") if ln.strip()]
+    # splitlines() already handles \r\n / \r / \n without extra full-string passes
+    return [ln for ln in map(str.strip, text.splitlines()) if ln]
 
 def _is_heading(line: str) -> bool:
-    return (
-        RE_PLAYER_OF_MATCH.match(line) is not None or
-        RE_TOP_BOWLER_TEAM.match(line) is not None or
-        RE_TOP_RUNSCORER_TEAM.match(line) is not None
-    )
-
-def _is_boundary(line: str) -> bool:
-    low = line.lower()
-    return _is_heading(line) or (low in STOP_WORDS)
+    # most lines are player names or prices: reject them without touching the regex
+    if line[:3].lower() not in _HEADING_PREFIXES:
+        return False
+    return RE_HEADING.match(line) is not None
+
+def _classify_lines(lines: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # label every line once up front (heading / boundary / decimal) so the block walk does no string work
+    ser = pd.Series(lines, dtype=object)
+    is_dec = ser.str.match(RE_DECIMAL).to_numpy(dtype=bool)
+    is_stop = ser.str.lower().isin(STOP_WORDS).to_numpy(dtype=bool)
+    is_head = np.fromiter(map(_is_heading, lines), dtype=bool, count=len(lines))
+    return is_head, is_head | is_stop, is_dec
 
 def _norm_player_name(s: str) -> str:
     # normalize for robust de-duping: trim, collapse spaces, casefold
     s = str(s or "").strip()
-    s = re.sub(r"\s+", " ", s)
+    s = RE_SPACES.sub(" ", s)
     return s.casefold()
 
-def _parse_block(lines: List[str], start: int, market: str, team: Optional[str]) -> Tuple[List[Dict], int]:
-    rows, j, pending = [], start + 1, None
-    while j < len(lines):
-        s = lines[j].strip()
-        if _is_boundary(s):
+def _parse_block(
+    lines: List[str], is_bound: np.ndarray, is_dec: np.ndarray, start: int, market: str, team: Optional[str]
+) -> List[Dict]:
+    rows, pending = [], None
+    for j in range(start + 1, len(lines)):
+        if is_bound[j]:
             break
-        if RE_DECIMAL.match(s):
+        if is_dec[j]:
             if pending:
-                rows.append({"Market": market, "Team": team or "", "SelectionName": pending, "SelectionOdds": s})
+                rows.append({"Market": market, "Team": team or "", "SelectionName": pending, "SelectionOdds": lines[j]})
                 pending = None
         else:
-            pending = s
-        j += 1
-    return rows, j
+            pending = lines[j]
+    return rows
 
+# cache is shared by all sessions: keep it bounded
+@st.cache_data(show_spinner=False, max_entries=64, ttl=3600)
 def parse_unibet(text: str) -> pd.DataFrame:
     lines = _lines(text or "")
-    out, i = [], 0
-    while i < len(lines):
-        s = lines[i]
-        if RE_PLAYER_OF_MATCH.match(s):
-            r, i = _parse_block(lines, i, "Player of the Match", None)
-            out += r
-            continue
-
-        m = RE_TOP_BOWLER_TEAM.match(s)
-        if m:
-            team = m.group(1).strip()
-            r, i = _parse_block(lines, i, "Top Bowler", team)
-            out += r
-            continue
-
-        m = RE_TOP_RUNSCORER_TEAM.match(s)
-        if m:
-            team = m.group(1).strip()
+    is_head, is_bound, is_dec = _classify_lines(lines)
+    out = []
+    # every block ends at a boundary and headings are boundaries, so walking the headings visits every block
+    for i in np.flatnonzero(is_head):
+        m = RE_HEADING.match(lines[i])
+        if m.group("bowler") is not None:
+            market, team = "Top Bowler", m.group("bowler").strip()
+        elif m.group("batter") is not None:
             # rename to Top Batter
-            r, i = _parse_block(lines, i, "Top Batter", team)
-            out += r
-            continue
-
-        i += 1
+            market, team = "Top Batter", m.group("batter").strip()
+        else:
+            market, team = "Player of the Match", None
+        out += _parse_block(lines, is_bound, is_dec, i, market, team)
 
     df = pd.DataFrame(out, columns=["Market","Team","SelectionName","SelectionOdds"]).reset_index(drop=True)
     if df.empty:
@@ -95,22 +103,29 @@ def parse_unibet(text: str) -> pd.DataFrame:
     df = df.reset_index(drop=True)
     # --- END FIX ---
 
+    # few distinct markets/teams: categorical codes keep these columns small and make filters cheap
+    df["Market"] = df["Market"].astype("category")
+    df["Team"] = df["Team"].astype("category")
     return df
 
 def detect_teams(parsed: pd.DataFrame) -> List[str]:
-    order = []
-    for _, r in parsed[parsed.Market.isin(["Top Bowler","Top Batter"])].iterrows():
-        t = r["Team"]
-        if t and t not in order:
-            order.append(t)
+    mask = parsed["Market"].isin(["Top Bowler","Top Batter"]) & parsed["Team"].ne("")
+    order = parsed.loc[mask, "Team"].drop_duplicates().tolist()
     if len(order) < 2:
         uniq = sorted([t for t in parsed.Team.unique() if t])
         order = (uniq + ["—","—"])[:2]
     return order[:2]
 
 # ---------- Boss helpers ----------
+RE_NON_ALNUM = re.compile(r'[^a-z0-9]')
+
+@functools.lru_cache(maxsize=1024)
 def _norm_key(s: str) -> str:
-    return re.sub(r'[^a-z0-9]', '', s.lower())
+    return RE_NON_ALNUM.sub('', s.lower())
+
+@functools.lru_cache(maxsize=1024)
+def _norm_space(s: str) -> str:
+    return RE_SPACES.sub(" ", s).strip().lower()
 
 def find_col(df: pd.DataFrame, candidates: List[str]) -> Optional[str]:
     norm = {_norm_key(c): c for c in df.columns}
@@ -122,37 +137,58 @@ def find_col(df: pd.DataFrame, candidates: List[str]) -> Optional[str]:
 
 def unique_markets(df: pd.DataFrame) -> pd.DataFrame:
     subset_keys = {"marketid","marketname","markettypeid","markettypename","startdate","suspenddate","startsuspensiondate"}
-    keep = [c for c in df.columns if _norm_key(c) in subset_keys]
+    norm_cols = [(_norm_key(c), c) for c in df.columns]
+    keep = [c for key, c in norm_cols if key in subset_keys]
     return df[keep].drop_duplicates().reset_index(drop=True) if keep else pd.DataFrame()
 
-def build_template_map(boss: pd.DataFrame, market_name_col: str) -> Dict[str, pd.Series]:
-    def _norm_space(s: str) -> str:
-        return re.sub(r"\s+"," ", str(s or "")).strip().lower()
-    m = {}
-    for _, row in boss.iterrows():
-        key = _norm_space(row.get(market_name_col, ""))
-        if key and key not in m:
-            m[key] = row
-    return m
+def build_template_map(boss: pd.DataFrame, market_name_col: str) -> Dict[str, Dict[str, str]]:
+    # same normaliser as the template lookups, so both sides collapse Unicode whitespace alike
+    keys = boss[market_name_col].fillna("").astype(str).map(_norm_space)
+    # first row per non-empty market name is the template
+    mask = keys.ne("") & ~keys.duplicated()
+    return dict(zip(keys[mask], boss.loc[mask].to_dict("records")))
+
+# Boss market names tried (in order) for each parsed market
+TEMPLATE_NAMES = {
+    "Player of the Match": ["Player of the Match"],
+    "Top Bowler": ["{team} Top Bowler", "Top Bowler - {team} - 1st Innings"],
+    "Top Batter": ["{team} Top Batter", "Top Batter - {team} - 1st Innings", "Top Run Scorer - {team} - 1st Innings"],
+}
+
+def build_template_index(
+    tmap: Dict[str, Dict[str, str]], teams: List[str]
+) -> Dict[Tuple[str, str], Dict[str, str]]:
+    index = {}
+    for market, names in TEMPLATE_NAMES.items():
+        for team in ([""] if market == "Player of the Match" else teams):
+            for name in names:
+                tpl = tmap.get(_norm_space(name.format(team=team)))
+                if tpl is not None:
+                    index[(market, team)] = tpl
+                    break
+    return index
 
 def replicate_from_template(
-    template: pd.Series,
+    template: Dict[str, str],
     selections: pd.DataFrame,
     outcols: List[str],
     sel_name_col: str,
-    sel_odds_col: str
-) -> pd.DataFrame:
-    base = pd.DataFrame([template.to_dict()] * len(selections))
-    base[sel_name_col] = selections["SelectionName"].values
-    base[sel_odds_col] = selections["SelectionOdds"].values
+    sel_odds_col: str,
+    first_col: Optional[str],
+    last_col: Optional[str],
+    any_col: Optional[str]
+) -> np.ndarray:
+    # repeat the template row into one (n × cols) object block, then overwrite whole columns in place;
+    # returned as a bare block so Export can stack all markets before building a single DataFrame
+    row = np.array([[template.get(c, "") for c in outcols]], dtype=object)
+    block = np.repeat(row, len(selections), axis=0)
+    block[:, outcols.index(sel_name_col)] = selections["SelectionName"].to_numpy()
+    block[:, outcols.index(sel_odds_col)] = selections["SelectionOdds"].to_numpy()
     # If these exist, blank them; do not create new ones
-    for cset in (["FirstOdds","firstodds","Firstodds"],
-                 ["LastOdds","lastodds","Lastodds"],
-                 ["AnyOdds","anyodds","Anyodds"]):
-        col = find_col(base, cset)
-        if col:
-            base[col] = ""
-    return base[outcols]
+    for c in (first_col, last_col, any_col):
+        if c:
+            block[:, outcols.index(c)] = ""
+    return block
 
 # ---------- Streamlit UI ----------
 st.set_page_config(page_title="Unibet → Boss Export", page_icon="📤", layout="wide")
@@ -174,25 +210,72 @@ export_click = colB.button("Export (CSV)")
 # Session state
 if "STATE" not in st.session_state:
     st.session_state.STATE = {
-        "boss": None, "parsed": None, "tmap": None, "outcols": None,
-        "sel_name_col": None, "sel_odds_col": None, "market_name_col": None
+        "boss": None, "parsed": None, "teams": None, "tpl_by_market_team": None, "outcols": None,
+        "sel_name_col": None, "sel_odds_col": None, "market_name_col": None,
+        "first_col": None, "last_col": None, "any_col": None
     }
 
 STATE = st.session_state.STATE
 
-def read_boss_from_upload(up_file) -> pd.DataFrame:
-    if up_file is None:
-        return pd.DataFrame()
-    name = (up_file.name or "").lower()
-    data = up_file.read()
-    bio = io.BytesIO(data)
+# pandas' default NA tokens for read_csv, so the pyarrow and pandas paths blank the same cells
+CSV_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+def _read_csv_str(bio: io.BytesIO) -> pd.DataFrame:
+    # pandas' engine="pyarrow" infers types before applying dtype=str (losing e.g. leading zeros),
+    # so read with pyarrow directly and declare every column a string
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        return pd.read_csv(bio, dtype=str).fillna("")
+    names = pd.read_csv(bio, nrows=0).columns.tolist()  # pandas' (mangled) header names
+    parse_options = pacsv.ParseOptions(newlines_in_values=True)
+    try:
+        bio.seek(0)
+        with pacsv.open_csv(bio, parse_options=parse_options) as reader:
+            arrow_names = reader.schema.names  # pyarrow's own view of the header
+        bio.seek(0)
+        table = pacsv.read_csv(
+            bio,
+            parse_options=parse_options,
+            convert_options=pacsv.ConvertOptions(
+                column_types={c: pa.string() for c in arrow_names},
+                null_values=CSV_NA_VALUES, strings_can_be_null=True
+            ),
+        )
+    except pa.ArrowInvalid:  # ragged rows etc.: let pandas handle them
+        table = None
+    if table is None or table.num_columns != len(names):
+        bio.seek(0)
+        return pd.read_csv(bio, dtype=str).fillna("")
+    return table.rename_columns(names).to_pandas().fillna("")
+
+# each entry holds a full Boss DataFrame and the cache is shared by all sessions: keep it small
+@st.cache_data(show_spinner=False, max_entries=8, ttl=3600)
+def _read_boss_cached(name: str, digest: str, _data: bytes) -> pd.DataFrame:
+    # keyed on (name, digest) only; the leading underscore tells Streamlit not to hash the raw bytes again
+    bio = io.BytesIO(_data)
     if name.endswith(".xlsx"):
-        df = pd.read_excel(bio, dtype=str).fillna("")
+        try:
+            df = pd.read_excel(bio, dtype=str, engine="calamine").fillna("")
+        except (ImportError, ValueError):  # python-calamine not installed, or pandas < 2.2 without the engine
+            bio.seek(0)
+            df = pd.read_excel(bio, dtype=str).fillna("")
     else:
-        df = pd.read_csv(bio, dtype=str).fillna("")
+        df = _read_csv_str(bio)
     # Preserve exact columns/order as uploaded
     return df[df.columns]
 
+def read_boss_from_upload(up_file) -> pd.DataFrame:
+    if up_file is None:
+        return pd.DataFrame()
+    data = up_file.getvalue()  # does not consume the upload, unlike read()
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return _read_boss_cached((up_file.name or "").lower(), digest, data)
+
 # ---------- Parse ----------
 if parse_click:
     if boss_file is None:
@@ -212,20 +295,27 @@ if parse_click:
                 if parsed.empty:
                     st.error("No selections parsed from Unibet text.")
                 else:
-                    counts = parsed.groupby(["Market","Team"]).size().reset_index(name="rows")
+                    counts = parsed.groupby(["Market","Team"], observed=True).size().reset_index(name="rows")
                     st.subheader("Parsed counts")
                     st.dataframe(counts, use_container_width=True)
                     st.subheader("Boss template markets (sample)")
                     st.dataframe(unique_markets(boss).head(200), use_container_width=True)
 
+                    # hard guard: keep only non-empty string team names
+                    teams = [t.strip() for t in detect_teams(parsed) if isinstance(t, str) and t.strip()]
+                    tmap = build_template_map(boss, market_name_col)
                     STATE.update({
                         "boss": boss,
                         "parsed": parsed,
-                        "tmap": build_template_map(boss, market_name_col),
+                        "teams": teams,
+                        "tpl_by_market_team": build_template_index(tmap, teams),
                         "outcols": list(boss.columns),
                         "sel_name_col": sel_name_col,
                         "sel_odds_col": sel_odds_col,
-                        "market_name_col": market_name_col
+                        "market_name_col": market_name_col,
+                        "first_col": find_col(boss, ["FirstOdds","firstodds","Firstodds"]),
+                        "last_col": find_col(boss, ["LastOdds","lastodds","Lastodds"]),
+                        "any_col": find_col(boss, ["AnyOdds","anyodds","Anyodds"])
                     })
                     st.success(f"Parsed. Using columns: {sel_name_col} / {sel_odds_col}. Ready to Export.")
 
@@ -235,61 +325,38 @@ if export_click:
     if boss is None or parsed is None:
         st.error("Click Parse first.")
     else:
-        outcols = STATE["outcols"]; tmap = STATE["tmap"]
+        outcols = STATE["outcols"]; tpl_by_market_team = STATE["tpl_by_market_team"]
         sel_name_col = STATE["sel_name_col"]; sel_odds_col = STATE["sel_odds_col"]
+        blank_cols = (STATE["first_col"], STATE["last_col"], STATE["any_col"])
 
-        def tpl_by_name(name: str) -> Optional[pd.Series]:
-            key = re.sub(r"\s+"," ", (name or "").strip().lower())
-            return tmap.get(key, None)
+        def tpl(market: str, team: str = "") -> Optional[Dict[str, str]]:
+            return tpl_by_market_team.get((market, team))
 
         chunks, notes = [], []
 
         # 1) Player of the Match
-        potm_sel = parsed[parsed.Market == "Player of the Match"]
-        potm_tpl = tpl_by_name("Player of the Match")
+        potm_sel = parsed[parsed.Market.eq("Player of the Match")]
+        potm_tpl = tpl("Player of the Match")
         if potm_tpl is not None and not potm_sel.empty:
-            chunks.append(replicate_from_template(potm_tpl, potm_sel, outcols, sel_name_col, sel_odds_col))
+            chunks.append(replicate_from_template(potm_tpl, potm_sel, outcols, sel_name_col, sel_odds_col, *blank_cols))
         else:
             notes.append("Player of the Match: missing template row or no selections.")
 
         # 2) Teams (Top Bowler + Top Batter)
-        teams = detect_teams(parsed)
-        for team in teams:
-            if not isinstance(team, str):  # hard guard
-                continue
-            team = team.strip()
-            if not team:
-                continue
-
-            # Top Bowler
-            tb_sel = parsed[(parsed.Market == "Top Bowler") & (parsed.Team == team)]
-            tb_tpl = tpl_by_name(f"{team} Top Bowler")
-            if tb_tpl is None:
-                tb_tpl = tpl_by_name(f"Top Bowler - {team} - 1st Innings")
-
-            if tb_tpl is not None and not tb_sel.empty:
-                chunks.append(replicate_from_template(tb_tpl, tb_sel, outcols, sel_name_col, sel_odds_col))
-            else:
-                notes.append(f"Top Bowler — {team}: no template row or no selections.")
-
-            # Top Batter
-            tbat_sel = parsed[(parsed.Market == "Top Batter") & (parsed.Team == team)]
-            tbat_tpl = tpl_by_name(f"{team} Top Batter")
-            if tbat_tpl is None:
-                # try common variants
-                tbat_tpl = tpl_by_name(f"Top Batter - {team} - 1st Innings")
-                if tbat_tpl is None:
-                    tbat_tpl = tpl_by_name(f"Top Run Scorer - {team} - 1st Innings")
-
-            if tbat_tpl is not None and not tbat_sel.empty:
-                chunks.append(replicate_from_template(tbat_tpl, tbat_sel, outcols, sel_name_col, sel_odds_col))
-            else:
-                notes.append(f"Top Batter — {team}: no template row or no selections.")
+        for team in STATE["teams"]:
+            for market in ("Top Bowler", "Top Batter"):
+                team_sel = parsed[parsed.Market.eq(market) & parsed.Team.eq(team)]
+                team_tpl = tpl(market, team)
+                if team_tpl is not None and not team_sel.empty:
+                    chunks.append(replicate_from_template(team_tpl, team_sel, outcols, sel_name_col, sel_odds_col, *blank_cols))
+                else:
+                    notes.append(f"{market} — {team}: no template row or no selections.")
 
         if not chunks:
             st.error("No output built." + (" " + "; ".join(notes) if notes else ""))
         else:
-            out_df = pd.concat(chunks, ignore_index=True)
+            # every chunk is an (n × outcols) block, so stack them and wrap once instead of pd.concat
+            out_df = pd.DataFrame(np.concatenate(chunks, axis=0), columns=outcols, copy=False)
 
             # --- FINAL SAFETY FIX: dedupe output per MarketId + SelectionName (prevents any accidental duplicates) ---
             market_id_col = find_col(out_df, ["MarketId", "marketid"])